@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+download = pytest.importorskip("youtube_commons.download")
+
+
+def _touch(path):
+    with open(path, "w") as f:
+        f.write("x")
+
+
+def test_filter_missing_ignores_leftover_files(tmp_path):
+    shard_dir = tmp_path / "ab"
+    shard_dir.mkdir()
+    leftovers = {
+        "abFragment": "abFragment.webm.part-Frag3",
+        "abYtdl": "abYtdl.webm.ytdl",
+        "abTemp": "abTemp.temp.m4a",
+        "abPart": "abPart.m4a.part",
+    }
+    for name in leftovers.values():
+        _touch(shard_dir / name)
+    _touch(shard_dir / "abDone.m4a")
+
+    downloader = download.VideoDownloader(str(tmp_path))
+    video_ids = sorted(leftovers) + ["abDone"]
+    assert downloader.filter_missing(video_ids) == sorted(leftovers)
+    assert downloader._cached_path("abDone", str(shard_dir)) == os.path.join(
+        str(shard_dir), "abDone.m4a"
+    )
@@ -8,8 +8,19 @@ logger = logging.getLogger(__name__)
 
 
 class VideoDatabase:
-    def __init__(self, path):
+    def __init__(self, path, wal=False):
         self.con = sqlite3.connect(path)
+        # WAL is persisted in the database file and needs shared memory, so it is only enabled
+        # for catalog databases written locally, never for shards handed out to other jobs
+        if wal and path != ":memory:":
+            # Writes append to a log instead of rewriting pages, and readers don't block on them
+            self.con.execute("PRAGMA journal_mode=WAL")
+            # In WAL mode this only fsyncs at checkpoints and is still safe against corruption
+            self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("PRAGMA busy_timeout=5000")
+        self.con.execute("PRAGMA temp_store=MEMORY")
+        # Negative sizes are in KiB, so this is a 20MB page cache
+        self.con.execute("PRAGMA cache_size=-20000")
         self.cur = self.con.cursor()
         self.init_db_tables()
 
@@ -19,6 +30,12 @@ class VideoDatabase:
             self.con.commit()
         return ret
 
+    def execute_one(self, *args, **kwargs):
+        """
+        Run a query expected to match at most one row and return that row or None.
+        """
+        return self.cur.execute(*args, **kwargs).fetchone()
+
     def init_db_tables(self):
         self.execute(
             """CREATE TABLE IF NOT EXISTS videos(video_id TEXT PRIMARY KEY, 
@@ -31,40 +48,95 @@ class VideoDatabase:
                 duration INT)""",
             commit=True,
         )
+        # Covers get_channel_video_ids, so the lookup never has to visit the table itself.
+        # It supersedes the older single-column index.
+        self.execute("DROP INDEX IF EXISTS videos_channel_id")
+        self.execute(
+            "CREATE INDEX IF NOT EXISTS videos_channel_id_video_id ON videos(channel_id, video_id)",
+            commit=True,
+        )
         self.execute(
             """CREATE TABLE IF NOT EXISTS channels(channel_id TEXT PRIMARY KEY, 
                 name TEXT, 
-                completed INT DEFAULT 0)""",
+                completed INT DEFAULT 0,
+                uploads_playlist_id TEXT)""",
+            commit=True,
+        )
+        # Databases created before uploads_playlist_id was added need the column added
+        channel_columns = [
+            column[1] for column in self.execute("PRAGMA table_info(channels)")
+        ]
+        if "uploads_playlist_id" not in channel_columns:
+            self.execute(
+                "ALTER TABLE channels ADD COLUMN uploads_playlist_id TEXT", commit=True
+            )
+        # Partial index that only holds channels still to be cataloged
+        self.execute(
+            "CREATE INDEX IF NOT EXISTS channels_uncompleted ON channels(channel_id) WHERE completed = 0",
             commit=True,
         )
 
     def add_video(
         self, video_id, channel_id, title, description, tags, published_time, duration
     ):
-        try:
-            self.execute(
-                "INSERT INTO videos(video_id, channel_id, title, description, tags, published_time, duration) VALUES(?, ?, ?, ?, ?, ?, ?)",
-                (
-                    video_id,
-                    channel_id,
-                    title,
-                    description,
-                    json.dumps(tags),
-                    published_time,
-                    duration,
-                ),
-                commit=True,
-            )
+        self.execute(
+            "INSERT OR IGNORE INTO videos(video_id, channel_id, title, description, tags, published_time, duration) VALUES(?, ?, ?, ?, ?, ?, ?)",
+            (
+                video_id,
+                channel_id,
+                title,
+                description,
+                json.dumps(tags),
+                published_time,
+                duration,
+            ),
+            commit=True,
+        )
+        if self.cur.rowcount == 1:
             return True
-        except sqlite3.IntegrityError:
-            logger.error(f"Failed to insert video {video_id} (already exists)")
-            return False
+        logger.debug(f"Skipped inserting video {video_id} (already exists)")
+        return False
+
+    def add_videos(self, videos, encode_tags=True):
+        """
+        Insert `(video_id, channel_id, title, description, tags, published_time, duration)`
+        rows in a single transaction, skipping videos that already exist.
+        Pass `encode_tags=False` when `tags` is already a JSON string.
+        Returns the number of videos inserted.
+        """
+        with self.con:
+            return self._insert_videos(videos, encode_tags)
+
+    def _insert_videos(self, videos, encode_tags=True):
+        if encode_tags:
+            videos = (
+                (v_id, c_id, title, desc, json.dumps(tags), pt, dur)
+                for (v_id, c_id, title, desc, tags, pt, dur) in videos
+            )
+        self.cur.executemany(
+            "INSERT OR IGNORE INTO videos(video_id, channel_id, title, description, tags, published_time, duration) VALUES(?, ?, ?, ?, ?, ?, ?)",
+            videos,
+        )
+        return self.cur.rowcount
+
+    def add_channel_videos(self, channel_id, videos):
+        """
+        Insert a channel's videos (see `add_videos`) and mark the channel completed in a single
+        transaction, so a channel is never marked completed without its videos.
+        Returns the number of videos inserted.
+        """
+        with self.con:
+            num_added = self._insert_videos(videos)
+            self.cur.execute(
+                "UPDATE channels SET completed = 1 WHERE channel_id = ?", (channel_id,)
+            )
+        return num_added
 
     def get_video(self, video_id):
-        video_result = self.execute(
+        video_result = self.execute_one(
             "SELECT * FROM videos WHERE video_id = ?", (video_id,)
         )
-        if len(video_result) == 0:
+        if video_result is None:
             return None
         else:
             (
@@ -76,7 +148,7 @@ class VideoDatabase:
                 published_time,
                 cataloged_time,
                 duration,
-            ) = video_result[0]
+            ) = video_result
             return (
                 video_id,
                 channel_id,
@@ -94,33 +166,65 @@ class VideoDatabase:
         )
         return [video_id for (video_id,) in video_result]
 
+    def iter_all_videos(self, decode_tags=True):
+        """
+        Yield every video row like `get_all_videos` without loading the whole table in memory.
+        With `decode_tags=False` tags are left as the stored JSON string.
+        """
+        # A dedicated cursor so other queries on this database don't reset the iteration
+        cur = self.con.execute("SELECT * FROM videos")
+        if not decode_tags:
+            yield from cur
+            return
+        for v_id, c_id, title, desc, tags, pt, ct, dur in cur:
+            yield (v_id, c_id, title, desc, json.loads(tags), pt, ct, dur)
+
     def get_all_videos(self):
-        videos = self.execute("SELECT * FROM videos")
-        return [
-            (v_id, c_id, title, desc, json.loads(tags), pt, ct, dur)
-            for (v_id, c_id, title, desc, tags, pt, ct, dur) in videos
-        ]
+        return list(self.iter_all_videos())
 
-    def add_channel(self, channel_id, channel_name):
-        try:
-            self.execute(
-                "INSERT INTO channels(channel_id, name) VALUES(?, ?)",
-                (channel_id, channel_name),
-                commit=True,
-            )
+    def get_video_count_and_duration(self):
+        """
+        Return `(num_videos, total_duration)` with the total duration in seconds.
+        """
+        ((num_videos, total_duration),) = self.execute(
+            "SELECT COUNT(*), COALESCE(SUM(duration), 0) FROM videos"
+        )
+        return num_videos, total_duration
+
+    def get_video_ids_and_durations(self):
+        return self.execute("SELECT video_id, duration FROM videos")
+
+    def add_channel(self, channel_id, channel_name, uploads_playlist_id=None):
+        self.execute(
+            "INSERT OR IGNORE INTO channels(channel_id, name, uploads_playlist_id) VALUES(?, ?, ?)",
+            (channel_id, channel_name, uploads_playlist_id),
+            commit=True,
+        )
+        if self.cur.rowcount == 1:
             return True
-        except sqlite3.IntegrityError:
-            logger.error(f"Failed to insert channel {channel_id} (already exists)")
-            return False
+        logger.debug(f"Skipped inserting channel {channel_id} (already exists)")
+        return False
+
+    def add_channels(self, channels):
+        """
+        Insert `(channel_id, channel_name, uploads_playlist_id)` rows in a single transaction,
+        skipping channels that already exist. Returns the number of channels inserted.
+        """
+        # Consume the rows before opening the transaction so it never waits on their producer
+        channels = list(channels)
+        if len(channels) == 0:
+            return 0
+        with self.con:
+            self.cur.executemany(
+                "INSERT OR IGNORE INTO channels(channel_id, name, uploads_playlist_id) VALUES(?, ?, ?)",
+                channels,
+            )
+        return self.cur.rowcount
 
     def get_channel(self, channel_id):
-        channel_result = self.execute(
+        return self.execute_one(
             "SELECT * FROM channels WHERE channel_id = ?", (channel_id,)
         )
-        if len(channel_result) == 0:
-            return None
-        else:
-            return channel_result[0]
 
     def get_all_channels(self):
         return [
@@ -128,6 +232,15 @@ class VideoDatabase:
             for (channel_id,) in self.execute("SELECT channel_id FROM channels")
         ]
 
+    def get_channel_counts(self):
+        """
+        Return `(num_channels, num_uncompleted_channels)`.
+        """
+        ((num_channels, num_uncompleted_channels),) = self.execute(
+            "SELECT COUNT(*), COALESCE(SUM(completed = 0), 0) FROM channels"
+        )
+        return num_channels, num_uncompleted_channels
+
     def get_uncompleted_channels(self):
         return [
             channel_id
@@ -136,6 +249,28 @@ class VideoDatabase:
             )
         ]
 
+    def get_uncompleted_channel_playlists(self):
+        """
+        Return `(channel_id, uploads_playlist_id)` for uncompleted channels. The playlist id is
+        None if it has not been looked up yet.
+        """
+        return self.execute(
+            "SELECT channel_id, uploads_playlist_id FROM channels WHERE completed=0"
+        )
+
+    def set_uploads_playlist_ids(self, playlists):
+        """
+        Store `(channel_id, uploads_playlist_id)` pairs in a single transaction.
+        """
+        with self.con:
+            self.cur.executemany(
+                "UPDATE channels SET uploads_playlist_id = ? WHERE channel_id = ?",
+                (
+                    (uploads_playlist_id, channel_id)
+                    for channel_id, uploads_playlist_id in playlists
+                ),
+            )
+
     def mark_channel_completed(self, channel_id):
         self.execute(
             "UPDATE channels SET completed = 1 WHERE channel_id = ?",
@@ -1,10 +1,16 @@
 import os
 import json
 import logging
-from glob import glob
 import io
 import os
 import tempfile
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    wait,
+)
 
 import yt_dlp
 
@@ -13,60 +19,252 @@ from youtube_commons import utils
 
 logger = logging.getLogger(__name__)
 
+# Extensions yt_dlp most commonly produces for "bestaudio/best"
+_LIKELY_EXTS = (".m4a", ".webm", ".opus", ".mp3")
+
+
+def _is_partial_download(video_id, extension):
+    """
+    Whether a `{video_id}{extension}` file in a shard is left over from an unfinished
+    download: a `.part`/`.ytdl` file, a `.part-FragN` fragment or an intermediate such
+    as `{id}.temp.m4a`. Video ids never contain dots, so any dotted stem is a leftover.
+    """
+    return (
+        "." in video_id
+        or extension in (".part", ".ytdl")
+        or extension.startswith(".part-Frag")
+    )
+
+
+class _YtDlpLogger:
+    """
+    Route yt_dlp's output through the module logger. Its errors are also raised as
+    `DownloadError` and reported by the caller, so they are only kept at debug level here.
+    """
 
-class QuietLogger:
     def debug(self, msg):
-        pass
+        logger.debug(msg)
+
+    def info(self, msg):
+        logger.debug(msg)
 
     def warning(self, msg):
-        pass
+        logger.warning(msg)
 
     def error(self, msg):
-        pass
+        logger.debug(msg)
 
 
 class VideoDownloader:
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, rate_limit=None):
         self.output_dir = output_dir
         self.opts = {
             "format": "bestaudio/best",
-            "rate_limit": "1M",
+            # Per-download cap in bytes/s, e.g. "1M" (None is unlimited)
+            "ratelimit": yt_dlp.utils.parse_bytes(rate_limit) if rate_limit else None,
+            # Fetch DASH/HLS fragments of a single video concurrently
+            "concurrent_fragment_downloads": 4,
+            # Audio fixups are tiny, so single-threaded ffmpeg avoids oversubscribing cores
+            "postprocessor_args": {"ffmpeg": ["-threads", "1"]},
+            # Without a logger, yt_dlp writes errors to stderr on top of the caller's own report
+            "logger": _YtDlpLogger(),
             "quiet": True,
             "noprogress": True,
-            "logger": QuietLogger(),
+            "progress_hooks": [self._progress_hook],
         }
+        # Maps video_id -> bytes downloaded, as reported by the progress hook
+        self._downloaded_bytes = {}
+        # yt_dlp.YoutubeDL instances are not thread-safe, so each thread gets its own
+        self._local = threading.local()
+        self._ydls = []
+        self._ydls_lock = threading.Lock()
+        # Maps shard directory -> {video_id: path} of files already in that directory
+        self._shard_cache = {}
+        self._created_dirs = set()
+
+    def get_ydl(self):
+        if not hasattr(self._local, "ydl"):
+            self._local.ydl = yt_dlp.YoutubeDL(self.opts.copy())
+            with self._ydls_lock:
+                self._ydls.append(self._local.ydl)
+        return self._local.ydl
+
+    def _progress_hook(self, d):
+        if d["status"] == "finished":
+            nbytes = d.get("total_bytes") or d.get("downloaded_bytes")
+            self._downloaded_bytes[d["info_dict"]["id"]] = nbytes
+
+    def close(self):
+        with self._ydls_lock:
+            for ydl in self._ydls:
+                ydl.close()
+            self._ydls.clear()
+        self._local = threading.local()
 
     def get_output_dir(self, video_id):
-        return os.path.basename(utils.video_id_to_path(self.output_dir, video_id, ""))
+        return os.path.join(self.output_dir, video_id[:2])
 
     def get_output_file_tmpl(self, video_id):
         return utils.video_id_to_path(self.output_dir, video_id, ".%(ext)s")
 
-    def get_output_file_glob(self, video_id):
-        return utils.video_id_to_path(self.output_dir, video_id, ".*")
-
     def get_video_url(self, video_id):
         return f"https://www.youtube.com/watch?v={video_id}"
 
+    def _shard_contents(self, shard_dir):
+        """
+        Return `{video_id: path}` for the finished downloads in `shard_dir`, scanning the
+        directory only the first time it is seen.
+        """
+        if shard_dir not in self._shard_cache:
+            contents = {}
+            if os.path.isdir(shard_dir):
+                for entry in os.scandir(shard_dir):
+                    video_id, extension = os.path.splitext(entry.name)
+                    if not _is_partial_download(video_id, extension):
+                        contents[video_id] = entry.path
+            self._shard_cache.setdefault(shard_dir, contents)
+        return self._shard_cache[shard_dir]
+
+    def _cached_path(self, video_id, output_dir):
+        """
+        Return the path of an existing download for `video_id` in its shard directory
+        `output_dir` or None. A shard that has not been scanned is not scanned here; only the
+        likely extensions are checked, so a download with a rarer extension is missed unless
+        `filter_missing` has already scanned its shard.
+        """
+        if output_dir in self._shard_cache:
+            return self._shard_cache[output_dir].get(video_id)
+        path_prefix = os.path.join(output_dir, video_id)
+        for ext in _LIKELY_EXTS:
+            path = path_prefix + ext
+            if os.path.exists(path):
+                return path
+        return None
+
+    def filter_missing(self, video_ids):
+        """
+        Return the subset of `video_ids` that have not been downloaded yet, scanning each shard
+        directory at most once. Call this before iterating `download` when resuming a large run.
+        """
+        return [
+            video_id
+            for video_id in video_ids
+            if video_id not in self._shard_contents(self.get_output_dir(video_id))
+        ]
+
     def download(self, video_id, overwrite=False):
         output_dir = self.get_output_dir(video_id)
-        os.makedirs(output_dir, exist_ok=True)
-        
-        output_files = glob(self.get_output_file_glob(video_id))
-        if len(output_files) > 0 and not overwrite:
+        if output_dir not in self._created_dirs:
+            os.makedirs(output_dir, exist_ok=True)
+            self._created_dirs.add(output_dir)
+
+        output_file = None if overwrite else self._cached_path(video_id, output_dir)
+        if output_file is not None:
             logger.info(
                 f"Skipping download for {video_id} -- output file already exists"
             )
-            output_file = output_files[0]
             nbytes = os.path.getsize(output_file)
             return {"path": output_file, "nbytes": nbytes}
 
-        opts = self.opts.copy()
-        opts["outtmpl"] = self.get_output_file_tmpl(video_id)
+        ydl = self.get_ydl()
+        ydl.params["outtmpl"] = {"default": self.get_output_file_tmpl(video_id)}
 
         video_url = self.get_video_url(video_id)
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            download_metadata = ydl.extract_info(video_url, download=True)
+        download_metadata = ydl.extract_info(video_url, download=True)
         download_path = ydl.prepare_filename(download_metadata)
-        nbytes = os.path.getsize(download_path)
+        # Prefer the sizes yt_dlp already knows over re-stat'ing the file we just wrote
+        nbytes = (
+            self._downloaded_bytes.pop(video_id, None)
+            or download_metadata.get("filesize")
+            or os.path.getsize(download_path)
+        )
+        # Only keep shards that were already scanned up to date; an unscanned shard will pick
+        # the new file up if it is ever scanned
+        if output_dir in self._shard_cache:
+            self._shard_cache[output_dir][video_id] = download_path
         return {"path": download_path, "nbytes": nbytes}
+
+    def download_many(self, video_ids, max_workers=10, overwrite=False):
+        """
+        Download `video_ids` concurrently on a thread pool, yielding `(video_id, result)` pairs
+        in completion order. `result` is the return value of `download` or the raised exception.
+        """
+        pending_video_ids = iter(video_ids)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_video_id = {}
+
+            def submit_download():
+                video_id = next(pending_video_ids, None)
+                if video_id is not None:
+                    future = executor.submit(self.download, video_id, overwrite=overwrite)
+                    future_to_video_id[future] = video_id
+
+            # Keep a few videos queued per worker instead of submitting every video up front
+            for _ in range(2 * max_workers):
+                submit_download()
+
+            while future_to_video_id:
+                done, _ = wait(future_to_video_id, return_when=FIRST_COMPLETED)
+                for future in done:
+                    video_id = future_to_video_id.pop(future)
+                    submit_download()
+                    try:
+                        yield video_id, future.result()
+                    except Exception as e:
+                        yield video_id, e
+
+
+# Per-process downloader used by BatchDownloader workers
+_worker_downloader = None
+
+
+def _init_worker_downloader(output_dir, rate_limit):
+    global _worker_downloader
+    _worker_downloader = VideoDownloader(output_dir, rate_limit=rate_limit)
+
+
+def _worker_download(video_id, overwrite):
+    try:
+        return _worker_downloader.download(video_id, overwrite=overwrite)
+    except Exception as e:
+        # yt_dlp exceptions carry tracebacks that cannot be pickled back to the parent
+        return Exception(f"{type(e).__name__}: {e}")
+
+
+class BatchDownloader:
+    """
+    Process-pool counterpart to `VideoDownloader.download_many` for batches where the
+    GIL-bound parts of extraction (signature deciphering, manifest parsing) dominate.
+    Each worker process keeps one `VideoDownloader` for its lifetime.
+    """
+
+    def __init__(self, output_dir, max_workers=None, rate_limit=None):
+        self.output_dir = output_dir
+        self.rate_limit = rate_limit
+        self.max_workers = max_workers or os.cpu_count()
+
+    def download_many(self, video_ids, overwrite=False):
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker_downloader,
+            initargs=(self.output_dir, self.rate_limit),
+        ) as executor:
+            future_to_video_id = {}
+            pending_video_ids = iter(video_ids)
+
+            def submit_download():
+                video_id = next(pending_video_ids, None)
+                if video_id is not None:
+                    future = executor.submit(_worker_download, video_id, overwrite)
+                    future_to_video_id[future] = video_id
+
+            # Keep a few videos queued per worker instead of submitting every video up front
+            for _ in range(2 * self.max_workers):
+                submit_download()
+
+            while future_to_video_id:
+                done, _ = wait(future_to_video_id, return_when=FIRST_COMPLETED)
+                for future in done:
+                    video_id = future_to_video_id.pop(future)
+                    submit_download()
+                    yield video_id, future.result()
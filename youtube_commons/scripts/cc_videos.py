@@ -1,27 +1,46 @@
 import argparse
+import collections
 import os
 import logging
-import hashlib
 import itertools
-from collections import defaultdict
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 import multiprocessing as mp
 import random
-from glob import glob
+import threading
 import traceback
 
-import isodate
+import ctranslate2
 from tqdm.auto import tqdm
-from faster_whisper import WhisperModel
+from faster_whisper import WhisperModel, BatchedInferencePipeline
 
 from youtube_commons import utils
-from youtube_commons.youtube_api import YouTubeAPICaller
+from youtube_commons.youtube_api import (
+    ExhaustedAPIKeys,
+    NoMoreAPIKeysError,
+    YouTubeAPICaller,
+)
 from youtube_commons.database import VideoDatabase
 from youtube_commons.download import VideoDownloader
 
 
 logger = logging.getLogger(__name__)
 
+# Whisper model for the current worker process, loaded once and reused for every video
+_model = None
+
+# Per-thread YouTube API callers used by add-videos
+_api_callers = threading.local()
+_api_caller_count = itertools.count()
+_exhausted_api_keys = ExhaustedAPIKeys()
+
+# Number of rows buffered per shard before shard-db writes them out
+SHARD_WRITE_BATCH_SIZE = 10000
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -60,6 +79,12 @@ def parse_args():
     add_videos_parser.add_argument(
         "--db-path", required=True, help="Path to output database"
     )
+    add_videos_parser.add_argument(
+        "--n-workers",
+        default=8,
+        type=int,
+        help="Number of channels to crawl in parallel (Default: 8)",
+    )
     add_videos_parser.set_defaults(func=add_videos)
 
     print_stats_parser = subparser.add_parser(
@@ -84,6 +109,11 @@ def parse_args():
     shard_db_parser.add_argument(
         "--num-shards", required=True, type=int, help="Number of total shards"
     )
+    shard_db_parser.add_argument(
+        "--legacy-shard",
+        action="store_true",
+        help="Assign videos to shards with the SHA-256 hash used by older versions",
+    )
     shard_db_parser.set_defaults(func=shard_db)
 
     download_parser = subparser.add_parser(
@@ -108,6 +138,17 @@ def parse_args():
         type=int,
         help="Maximum number of videos to download",
     )
+    download_parser.add_argument(
+        "--rate-limit",
+        default=None,
+        help="Maximum download rate per video in bytes/s, e.g. 1M (Default: unlimited)",
+    )
+    download_parser.add_argument(
+        "--n-workers",
+        default=16,
+        type=int,
+        help="Number of videos to download in parallel (Default: 16)",
+    )
     download_parser.set_defaults(func=download_videos)
 
     transcribe_parser = subparser.add_parser(
@@ -141,8 +182,9 @@ def parse_args():
     )
     transcribe_parser.add_argument(
         "--compute-type",
-        default="int8",
+        default=None,
         choices=[
+            "auto",
             "int8",
             "int8_float32",
             "int8_float16",
@@ -151,7 +193,7 @@ def parse_args():
             "bfloat16",
             "float32",
         ],
-        help="Type to use for inference (Default: int8)",
+        help="Type to use for inference (Default: int8 on cpu, int8_float16 on cuda)",
     )
     transcribe_parser.add_argument(
         "--device",
@@ -159,6 +201,11 @@ def parse_args():
         choices=["cpu", "cuda"],
         help="CPU or GPU inference (Default: cpu)",
     )
+    transcribe_parser.add_argument(
+        "--flash-attention",
+        action="store_true",
+        help="Use FlashAttention on cuda (requires an Ampere or newer GPU)",
+    )
     transcribe_parser.add_argument(
         "--n-procs",
         default=-1,
@@ -171,6 +218,18 @@ def parse_args():
         type=int,
         help="Number of transcription threads per process (Default: 4)",
     )
+    transcribe_parser.add_argument(
+        "--beam-size",
+        default=2,
+        type=int,
+        help="Beam size for decoding; smaller beams decode faster (Default: 2)",
+    )
+    transcribe_parser.add_argument(
+        "--batch-size",
+        default=None,
+        type=int,
+        help="Number of speech chunks of a file to transcribe as one batch; values above 1 use faster-whisper's BatchedInferencePipeline (Default: 16 on cuda, 1 on cpu)",
+    )
     transcribe_parser.set_defaults(func=transcribe_videos)
 
     download_and_transcribe_parser = subparser.add_parser(
@@ -208,6 +267,17 @@ def parse_args():
         type=int,
         help="Maximum number of videos to download (Default: all videos)",
     )
+    download_and_transcribe_parser.add_argument(
+        "--rate-limit",
+        default=None,
+        help="Maximum download rate per video in bytes/s, e.g. 1M (Default: unlimited)",
+    )
+    download_and_transcribe_parser.add_argument(
+        "--n-downloaders",
+        default=8,
+        type=int,
+        help="Number of videos to download in parallel while others are transcribed (Default: 8)",
+    )
     download_and_transcribe_parser.add_argument(
         "--model-size",
         default="small",
@@ -216,8 +286,9 @@ def parse_args():
     )
     download_and_transcribe_parser.add_argument(
         "--compute-type",
-        default="int8",
+        default=None,
         choices=[
+            "auto",
             "int8",
             "int8_float32",
             "int8_float16",
@@ -226,7 +297,7 @@ def parse_args():
             "bfloat16",
             "float32",
         ],
-        help="Type to use for inference (Default: int8)",
+        help="Type to use for inference (Default: int8 on cpu, int8_float16 on cuda)",
     )
     download_and_transcribe_parser.add_argument(
         "--device",
@@ -234,6 +305,11 @@ def parse_args():
         choices=["cpu", "cuda"],
         help="CPU or GPU inference (Default: cpu)",
     )
+    download_and_transcribe_parser.add_argument(
+        "--flash-attention",
+        action="store_true",
+        help="Use FlashAttention on cuda (requires an Ampere or newer GPU)",
+    )
     download_and_transcribe_parser.add_argument(
         "--n-procs",
         default=-1,
@@ -246,6 +322,18 @@ def parse_args():
         type=int,
         help="Number of transcription threads per process (Default: 4)",
     )
+    download_and_transcribe_parser.add_argument(
+        "--beam-size",
+        default=2,
+        type=int,
+        help="Beam size for decoding; smaller beams decode faster (Default: 2)",
+    )
+    download_and_transcribe_parser.add_argument(
+        "--batch-size",
+        default=None,
+        type=int,
+        help="Number of speech chunks of a file to transcribe as one batch; values above 1 use faster-whisper's BatchedInferencePipeline (Default: 16 on cuda, 1 on cpu)",
+    )
     download_and_transcribe_parser.set_defaults(func=download_and_transcribe_videos)
 
     return parser.parse_args()
@@ -273,7 +361,7 @@ def setup_logger(log_file):
 
 
 def add_channels(args):
-    db = VideoDatabase(args.db_path)
+    db = VideoDatabase(args.db_path, wal=True)
     api_caller = YouTubeAPICaller(args.api_keys)
 
     if args.ids_file is not None:
@@ -284,56 +372,149 @@ def add_channels(args):
     metadata = api_caller.get_channel_metadata(args.ids)
 
     logger.info("Inserting channels into database")
+    num_added = 0
+    rows = []
     for channel_metadata in tqdm(metadata):
-        channel_id = channel_metadata["id"]
-        channel_name = channel_metadata["snippet"]["title"]
-        db.add_channel(channel_id, channel_name)
+        rows.append(
+            (
+                channel_metadata["id"],
+                channel_metadata["snippet"]["title"],
+                # Missing uploads playlist ids are looked up again by add-videos
+                channel_metadata.get("contentDetails", {})
+                .get("relatedPlaylists", {})
+                .get("uploads"),
+            )
+        )
+        # Commit each API page as it arrives so a later API failure doesn't lose it
+        if len(rows) == 50:
+            num_added += db.add_channels(rows)
+            rows = []
+    num_added += db.add_channels(rows)
+    logger.info(f"Added {num_added} new channels")
+
+
+def get_api_caller(args):
+    # googleapiclient clients are not thread-safe, so each thread builds its own. Every caller
+    # gets its own copy of the keys since callers pop keys off the list as they cycle.
+    if not hasattr(_api_callers, "caller"):
+        # Rotate the keys so threads start on different keys and spread requests across all
+        # of them. Exhausted keys are shared, so a key that hits its quota is dropped by
+        # every thread at once.
+        offset = next(_api_caller_count) % len(args.api_keys)
+        api_keys = args.api_keys[offset:] + args.api_keys[:offset]
+        _api_callers.caller = YouTubeAPICaller(api_keys, _exhausted_api_keys)
+    return _api_callers.caller
+
+
+def get_channel_videos(args, channel_id, uploads_playlist_id, existing_video_ids):
+    api_caller = get_api_caller(args)
+    return [
+        (
+            video_metadata["id"],
+            channel_id,
+            video_metadata["snippet"].get("title"),
+            video_metadata["snippet"].get("description"),
+            video_metadata["snippet"].get("tags"),
+            video_metadata["snippet"].get("publishedAt"),
+            utils.parse_duration(video_metadata["contentDetails"].get("duration")),
+        )
+        for video_metadata in api_caller.get_cc_videos_from_channel(
+            channel_id,
+            skip_video_ids=existing_video_ids,
+            uploads_playlist_id=uploads_playlist_id,
+        )
+    ]
 
 
 def add_videos(args):
-    db = VideoDatabase(args.db_path)
-    api_caller = YouTubeAPICaller(args.api_keys)
-
-    logger.info("Loading videos in the database")
-    existing_videos = defaultdict(set)
-    all_videos = db.get_all_videos()
-    for video in tqdm(all_videos):
-        channel_id, video_id = video[1], video[0]
-        existing_videos[channel_id].add(video_id)
+    db = VideoDatabase(args.db_path, wal=True)
+    api_caller = get_api_caller(args)
+
+    channel_playlists = db.get_uncompleted_channel_playlists()
+    channel_ids = [channel_id for channel_id, _ in channel_playlists]
+    uploads_playlist_ids = {
+        channel_id: uploads_playlist_id
+        for channel_id, uploads_playlist_id in channel_playlists
+        if uploads_playlist_id is not None
+    }
 
-    for channel_id in db.get_uncompleted_channels():
-        existing_video_ids = existing_videos[channel_id]
+    # Channels added before upload playlists were stored still need a lookup. This is done
+    # 50 channels per request and saved so it only happens once.
+    missing_channel_ids = [c for c in channel_ids if c not in uploads_playlist_ids]
+    if missing_channel_ids:
         logger.info(
-            f"Cataloging videos form channel {channel_id} ({len(existing_video_ids)} already found)"
+            f"Retrieving upload playlists for {len(missing_channel_ids)} channels"
         )
-        for video_metadata in tqdm(
-            api_caller.get_cc_videos_from_channel(
-                channel_id, skip_video_ids=existing_video_ids
+        found_playlists = dict(api_caller.get_uploads_playlist_ids(missing_channel_ids))
+        db.set_uploads_playlist_ids(found_playlists.items())
+        uploads_playlist_ids.update(found_playlists)
+
+    for channel_id in channel_ids:
+        if channel_id not in uploads_playlist_ids:
+            logger.info(f"Skipping channel {channel_id}: no uploads playlist found")
+            db.mark_channel_completed(channel_id)
+    channel_ids = [c for c in channel_ids if c in uploads_playlist_ids]
+
+    # Playlist pages must be fetched in order, so channels are crawled concurrently instead.
+    # Database reads and writes stay on this thread.
+    pending_channel_ids = iter(channel_ids)
+    keys_exhausted = False
+    with ThreadPoolExecutor(max_workers=args.n_workers) as executor:
+        future_to_channel_id = {}
+
+        def submit_channel():
+            # Don't start channels that can only fail once the API keys are used up
+            if keys_exhausted:
+                return
+            channel_id = next(pending_channel_ids, None)
+            if channel_id is None:
+                return
+            existing_video_ids = set(db.get_channel_video_ids(channel_id))
+            logger.info(
+                f"Cataloging videos form channel {channel_id} ({len(existing_video_ids)} already found)"
             )
-        ):
-            db.add_video(
-                video_metadata["id"],
+            future = executor.submit(
+                get_channel_videos,
+                args,
                 channel_id,
-                video_metadata["snippet"].get("title"),
-                video_metadata["snippet"].get("description"),
-                video_metadata["snippet"].get("tags"),
-                video_metadata["snippet"].get("publishedAt"),
-                isodate.parse_duration(
-                    video_metadata["contentDetails"].get("duration")
-                ).total_seconds(),
+                uploads_playlist_ids[channel_id],
+                existing_video_ids,
             )
-
-        db.mark_channel_completed(channel_id)
+            future_to_channel_id[future] = channel_id
+
+        for _ in range(args.n_workers):
+            submit_channel()
+
+        pbar = tqdm(total=len(channel_ids), unit=" channels", mininterval=1.0)
+        while future_to_channel_id:
+            done, _ = wait(future_to_channel_id, return_when=FIRST_COMPLETED)
+            for future in done:
+                channel_id = future_to_channel_id.pop(future)
+                # A failed channel is left uncompleted so the next run retries it, while
+                # channels still in flight are saved as they finish
+                try:
+                    rows = future.result()
+                except NoMoreAPIKeysError:
+                    logger.error(f"Failed to catalog channel {channel_id}: no more API keys")
+                    keys_exhausted = True
+                except Exception as e:
+                    logger.error(f"Failed to catalog channel {channel_id}: {e}")
+                    logger.error(f"Traceback: {traceback.format_exc()}")
+                else:
+                    # One transaction per channel for its videos and its completed flag
+                    db.add_channel_videos(channel_id, rows)
+                    pbar.update(1)
+                submit_channel()
+
+    if keys_exhausted:
+        logger.error("Stopped early after running out of API keys")
 
 
 def print_stats(args):
     db = VideoDatabase(args.db_path)
-    num_channels = len(db.get_all_channels())
-    num_uncompleted_channels = len(db.get_uncompleted_channels())
+    num_channels, num_uncompleted_channels = db.get_channel_counts()
     num_completed_channels = num_channels - num_uncompleted_channels
-    videos = db.get_all_videos()
-    num_videos = len(videos)
-    total_seconds = sum([v[-1] for v in videos])
+    num_videos, total_seconds = db.get_video_count_and_duration()
 
     logger.info(f"Channels Completed: {num_completed_channels}/{num_channels}")
     logger.info(f"Total Videos: {num_videos}")
@@ -349,7 +530,6 @@ def shard_db(args):
 
     logger.info(f"Loading database from {args.db_path}")
     db = VideoDatabase(args.db_path)
-    videos = db.get_all_videos()
 
     logger.info(f"Sharding database into {args.num_shards} shards")
     sharded_dbs = [
@@ -358,6 +538,8 @@ def shard_db(args):
         )
         for i in range(args.num_shards)
     ]
+    shard_videos = [[] for _ in range(args.num_shards)]
+    # Tags are copied as their stored JSON strings rather than decoded and re-encoded
     for (
         video_id,
         channel_id,
@@ -367,16 +549,27 @@ def shard_db(args):
         published_time,
         cataloged_time,
         duration,
-    ) in tqdm(videos):
-        shard_idx = utils.video_id_to_shard(video_id, args.num_shards)
-        sharded_dbs[shard_idx].add_video(
-            video_id, channel_id, title, description, tags, published_time, duration
+    ) in tqdm(db.iter_all_videos(decode_tags=False)):
+        shard_idx = utils.video_id_to_shard(
+            video_id, args.num_shards, legacy=args.legacy_shard
+        )
+        shard_videos[shard_idx].append(
+            (video_id, channel_id, title, description, tags, published_time, duration)
         )
+        # Flush full buffers as we go so the whole catalog is never held in memory
+        if len(shard_videos[shard_idx]) >= SHARD_WRITE_BATCH_SIZE:
+            sharded_dbs[shard_idx].add_videos(
+                shard_videos[shard_idx], encode_tags=False
+            )
+            shard_videos[shard_idx] = []
+
+    logger.info("Writing shards")
+    for sharded_db, rows in zip(sharded_dbs, tqdm(shard_videos)):
+        sharded_db.add_videos(rows, encode_tags=False)
 
 
-def download(args, video_id, output_dir):
+def download(args, downloader, video_id):
     try:
-        downloader = VideoDownloader(output_dir)
         return downloader.download(video_id, overwrite=args.overwrite)
     except Exception as e:
         logger.error(f"Failed to download {video_id}: {e}")
@@ -389,16 +582,14 @@ def download_videos(args):
 
     logger.info(f"Loading videos database from {args.db_path}")
     db = VideoDatabase(args.db_path)
-    videos = db.get_all_videos()
-    video_ids = [video[0] for video in videos]
+    video_durations = dict(db.get_video_ids_and_durations())
+    video_ids = list(video_durations)
+    downloader = VideoDownloader(args.output_dir, rate_limit=args.rate_limit)
 
     # Filter to only video_ids that have not already been downloaded
     if not args.overwrite:
         logger.info("Ignoring previously downloaded videos")
-        existing_video_ids = utils.get_existing_video_ids(
-            args.output_dir, filter_exts=[".part"]
-        )
-        video_ids = [v for v in video_ids if v not in existing_video_ids]
+        video_ids = downloader.filter_missing(video_ids)
 
     # Shuffle so that progress bar estimates aren't biased by collection order
     logger.info("Shuffling videos")
@@ -410,54 +601,135 @@ def download_videos(args):
 
     # Compute total duration of the videos for progress bar
     logger.info("Computing total duration of video set")
-    video_ids_set = set(video_ids)
-    video_duration_dict = {
-        video[0]: video[-1] for video in videos if video[0] in video_ids_set
-    }
-    total_duration = sum(video_duration_dict.values())
+    total_duration = sum(video_durations[video_id] for video_id in video_ids)
     logger.info(f"Downloading {total_duration/60/60:.3f} hours of video")
 
     postfix = {"Videos Downloaded": 0, "Errors": 0, "Downloaded Size (GB)": 0}
-    pbar = tqdm(video_ids, total=total_duration, unit=" video seconds")
-    for video_id in pbar:
-        download_info = download(args, video_id, args.output_dir)
-        if download_info is None:
+    pbar = tqdm(total=total_duration, unit=" video seconds", mininterval=1.0)
+    for video_id, download_info in downloader.download_many(
+        video_ids, max_workers=args.n_workers, overwrite=args.overwrite
+    ):
+        if isinstance(download_info, Exception):
+            e = download_info
+            tb = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+            logger.error(f"Failed to download {video_id}: {e}")
+            logger.error(f"Traceback: {tb}")
             postfix["Errors"] += 1
-            pbar.set_postfix(postfix)
         else:
             postfix["Downloaded Size (GB)"] += download_info["nbytes"] / 1e9
             postfix["Videos Downloaded"] += 1
-            pbar.update(video_duration_dict[video_id])
+            pbar.update(video_durations[video_id])
+
+        # Shown on the next redraw instead of forcing one per video
+        pbar.set_postfix(postfix, refresh=False)
+
+    downloader.close()
+
+
+def load_model(args):
+    global _model
+    if _model is None:
+        compute_type = args.compute_type
+        if compute_type is None:
+            # int8 weights with float16 activations use the GPU's tensor cores
+            compute_type = "int8_float16" if args.device == "cuda" else "int8"
+        supported_compute_types = ctranslate2.get_supported_compute_types(args.device)
+        if compute_type != "auto" and compute_type not in supported_compute_types:
+            logger.warning(
+                f"Compute type {compute_type} is not supported on this {args.device} and will be "
+                f"converted (supported: {', '.join(sorted(supported_compute_types))})"
+            )
+        # Only passed when requested so the default works with any CTranslate2 build
+        model_kwargs = {}
+        if args.flash_attention:
+            if args.device == "cuda":
+                model_kwargs["flash_attention"] = True
+            else:
+                logger.warning("FlashAttention is only available on cuda, ignoring")
+        _model = WhisperModel(
+            args.model_size,
+            device=args.device,
+            compute_type=compute_type,
+            cpu_threads=args.n_threads,
+            # On CUDA one model is shared by all transcription threads
+            num_workers=args.n_procs if args.device == "cuda" else 1,
+            **model_kwargs,
+        )
+        if args.batch_size > 1:
+            _model = BatchedInferencePipeline(model=_model)
+    return _model
+
+
+def init_cpu_worker(args, worker_counter):
+    # Spawned workers don't inherit the parent's logging handlers
+    setup_logger(args.log_file)
+    with worker_counter.get_lock():
+        worker_idx = worker_counter.value
+        worker_counter.value += 1
+
+    # Pin each worker to its own block of n_threads cores so workers' inference threads
+    # don't compete for (or migrate between) the same cores
+    if hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        start = worker_idx * args.n_threads
+        os.sched_setaffinity(
+            0, {cores[i % len(cores)] for i in range(start, start + args.n_threads)}
+        )
+
+    load_model(args)
+
 
-        pbar.set_postfix(postfix)
+def get_transcribe_executor(args):
+    """
+    On CUDA, load a single model and share it across a thread pool so the weights only occupy
+    GPU memory once. On CPU, use a process pool where each worker loads its own model.
+    """
+    if args.device == "cuda":
+        load_model(args)
+        return ThreadPoolExecutor(max_workers=args.n_procs)
+    # Workers start on the first submit, possibly while download threads are running, and
+    # forking a multi-threaded process can deadlock the child, so spawn them instead
+    mp_context = mp.get_context("spawn")
+    return ProcessPoolExecutor(
+        max_workers=args.n_procs,
+        mp_context=mp_context,
+        initializer=init_cpu_worker,
+        initargs=(args, mp_context.Value("i", 0)),
+    )
 
 
-def transcribe(args, video_id, input_dir, output_dir):
+def transcribe(args, video_id, input_file, output_dir):
     try:
-        input_files = glob(utils.video_id_to_path(input_dir, video_id, ".*"))
-        if len(input_files) == 0:
-            logger.error(f"No audio file downloaded for {video_id}")
-            return None
-        input_file = input_files[0]
-        
-        model = WhisperModel(
-            args.model_size,
-            device=args.device,
-            compute_type=args.compute_type,
-            cpu_threads=args.n_threads,
+        model = load_model(args)
+        batch_kwargs = {"batch_size": args.batch_size} if args.batch_size > 1 else {}
+        segments, info = model.transcribe(
+            input_file,
+            vad_filter=True,
+            beam_size=args.beam_size,
+            # Fall back to sampling on failed decodes, without the slowest high temperatures
+            temperature=[0.0, 0.2, 0.4, 0.6],
+            condition_on_previous_text=False,
+            # Only the text is saved, so skip decoding timestamp tokens
+            without_timestamps=True,
+            **batch_kwargs,
         )
-        segments, info = model.transcribe(input_file, vad_filter=True, beam_size=5)
-        transcript = "".join([segment.text for segment in segments])
 
         output_path = utils.video_id_to_path(output_dir, video_id, ".txt")
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "w") as f:
-            f.write(transcript)
 
-        return {
-            "path": output_path,
-            "nbytes": len(transcript.encode("utf-8", "ignore")),
-        }
+        # Write segments as they are decoded, then rename so a partial transcript is never
+        # mistaken for a finished one
+        partial_path = f"{output_path}.part"
+        nbytes = 0
+        with open(partial_path, "wb") as f:
+            for segment in segments:
+                # Encode each segment once and count the bytes actually written
+                data = segment.text.encode("utf-8", "ignore")
+                f.write(data)
+                nbytes += len(data)
+        os.replace(partial_path, output_path)
+
+        return {"path": output_path, "nbytes": nbytes}
 
     except Exception as e:
         logger.error(f"Failed to transcribe {video_id}: {e}")
@@ -468,14 +740,13 @@ def transcribe(args, video_id, input_dir, output_dir):
 def transcribe_videos(args):
     os.makedirs(args.output_dir, exist_ok=True)
 
-    video_ids = utils.get_existing_video_ids(args.input_dir, filter_exts=[".part"])
+    input_paths = utils.get_existing_video_paths(args.input_dir, filter_exts=[".part"])
+    video_ids = list(input_paths)
     logger.info(f"Found {len(video_ids)} audio files")
 
     # Filter to only files that have not already been transcribed (if --overwrite is not specified)
     if not args.overwrite:
-        already_transcribed = utils.get_existing_video_ids(
-            args.output_dir, keep_exts=[".txt"]
-        )
+        already_transcribed = utils.get_completed_video_ids(args.output_dir)
         video_ids = [v for v in video_ids if v not in already_transcribed]
 
     # Restrict to max_videos if specified
@@ -486,42 +757,62 @@ def transcribe_videos(args):
 
     if args.n_procs == -1:
         args.n_procs = mp.cpu_count() // args.n_threads
+    if args.batch_size is None:
+        args.batch_size = 16 if args.device == "cuda" else 1
     logger.info(
         f"Transcribing with {args.n_procs} processes and {args.n_threads} threads/process"
     )
 
     postfix = {"Videos Transcribed": 0, "Transcribed Size (MB)": 0, "Errors": 0}
-    with ProcessPoolExecutor(max_workers=args.n_procs) as executor:
-        future_to_video_id = {
-            executor.submit(
-                transcribe, args, video_id, args.input_dir, args.output_dir
-            ): video_id
-            for video_id in video_ids
-        }
-
-        pbar = tqdm(as_completed(future_to_video_id))
-        for future in pbar:
-            video_id = future_to_video_id[future]
-            transcribe_info = future.result()
-            if transcribe_info is None:
-                postfix["Errors"] += 1
-            else:
-                postfix["Videos Transcribed"] += 1
-                postfix["Transcribed Size (MB)"] += transcribe_info["nbytes"] / 1e6
-
-            pbar.set_postfix(postfix)
-
-
-def download_and_transcribe(args, video_id):
-    download_info = download(args, video_id, args.download_output_dir)
-    if download_info is None:
-        return None
+    with get_transcribe_executor(args) as executor, utils.open_completed_manifest(
+        args.output_dir
+    ) as manifest:
+        future_to_video_id = {}
+        pending_video_ids = iter(video_ids)
+
+        def submit_transcribe():
+            video_id = next(pending_video_ids, None)
+            if video_id is not None:
+                future = executor.submit(
+                    transcribe, args, video_id, input_paths[video_id], args.output_dir
+                )
+                future_to_video_id[future] = video_id
+
+        # Keep a few videos queued per worker instead of submitting every video up front
+        for _ in range(4 * args.n_procs):
+            submit_transcribe()
+
+        pbar = tqdm(total=len(video_ids), mininterval=1.0)
+        while future_to_video_id:
+            done, _ = wait(future_to_video_id, return_when=FIRST_COMPLETED)
+            for future in done:
+                video_id = future_to_video_id.pop(future)
+                transcribe_info = future.result()
+                if transcribe_info is None:
+                    postfix["Errors"] += 1
+                else:
+                    postfix["Videos Transcribed"] += 1
+                    postfix["Transcribed Size (MB)"] += transcribe_info["nbytes"] / 1e6
+                    manifest.write(f"{video_id}\n")
+
+                pbar.update(1)
+                pbar.set_postfix(postfix, refresh=False)
+                submit_transcribe()
+
+
+def transcribe_download(args, video_id, download_info):
     transcribe_info = transcribe(
-        args, video_id, args.download_output_dir, args.transcript_output_dir
+        args, video_id, download_info["path"], args.transcript_output_dir
     )
     if transcribe_info is None:
         return None
-    return {"download": download_info, "transcribe": transcribe_info}
+    if not args.keep_audio and os.path.exists(download_info["path"]):
+        # The transcript is already written, so a leftover audio file isn't a failure
+        try:
+            os.remove(download_info["path"])
+        except OSError as e:
+            logger.warning(f"Failed to remove audio for {video_id}: {e}")
+    return transcribe_info
 
 
 def download_and_transcribe_videos(args):
@@ -530,18 +821,17 @@ def download_and_transcribe_videos(args):
 
     logger.info(f"Loading videos database from {args.db_path}")
     db = VideoDatabase(args.db_path)
-    videos = db.get_all_videos()
-    video_ids = [video[0] for video in videos]
+    video_durations = dict(db.get_video_ids_and_durations())
+    video_ids = list(video_durations)
 
     # Filter to only video_ids that have not already been transcribed
     if not args.overwrite:
         logger.info("Ignoring previously transcribed videos")
-        existing_video_ids = utils.get_existing_video_ids(
-            args.transcript_output_dir, keep_exts=[".txt"]
-        )
+        existing_video_ids = utils.get_completed_video_ids(args.transcript_output_dir)
         video_ids = [v for v in video_ids if v not in existing_video_ids]
 
-    # Shuffle so that progress bar estimates aren't biased by collection order
+    # Shuffle so that --max-videos takes a random sample rather than the first videos collected
+    # (the order itself is replaced by the sort below)
     logger.info("Shuffling videos")
     random.shuffle(video_ids)
 
@@ -549,19 +839,21 @@ def download_and_transcribe_videos(args):
     if args.max_videos > 0:
         video_ids = video_ids[: args.max_videos]
 
+    # Start the longest videos first so a long video picked up near the end doesn't leave
+    # every other worker idle while it finishes
+    video_ids.sort(key=lambda video_id: video_durations[video_id], reverse=True)
+
     # Compute total duration of the videos for progress bar
     logger.info("Computing total duration of video set")
-    video_ids_set = set(video_ids)
-    video_duration_dict = {
-        video[0]: video[-1] for video in videos if video[0] in video_ids_set
-    }
-    total_duration = sum(video_duration_dict.values())
+    total_duration = sum(video_durations[video_id] for video_id in video_ids)
     logger.info(
         f"Downloading and transcribing {total_duration/60/60:.3f} hours of video"
     )
 
     if args.n_procs == -1:
         args.n_procs = mp.cpu_count() // args.n_threads
+    if args.batch_size is None:
+        args.batch_size = 16 if args.device == "cuda" else 1
     logger.info(
         f"Transcribing with {args.n_procs} processes and {args.n_threads} threads/process"
     )
@@ -572,34 +864,70 @@ def download_and_transcribe_videos(args):
         "Transcribed Size (MB)": 0,
         "Downloaded Size (GB)": 0,
     }
-    with ProcessPoolExecutor(max_workers=args.n_procs) as executor:
-        future_to_video_id = {
-            executor.submit(download_and_transcribe, args, video_id): video_id
-            for video_id in video_ids
-        }
-
-        pbar = tqdm(
-            as_completed(future_to_video_id),
-            total=total_duration,
-            unit=" video seconds",
-        )
-        for future in pbar:
-            video_id = future_to_video_id[future]
-            info = future.result()
-
-            if info is None:
-                postfix["Errors"] += 1
-            else:
-                if not args.keep_audio:
-                    if os.path.exists(info["download"]["path"]):
-                        os.remove(info["download"]["path"])
-
-                postfix["Videos Processed"] += 1
-                postfix["Transcribed Size (MB)"] += info["transcribe"]["nbytes"] / 1e6
-                postfix["Downloaded Size (GB)"] += info["download"]["nbytes"] / 1e9
-                pbar.update(video_duration_dict[video_id])
-
-            pbar.set_postfix(postfix)
+    pbar = tqdm(total=total_duration, unit=" video seconds", mininterval=1.0)
+    downloader = VideoDownloader(args.download_output_dir, rate_limit=args.rate_limit)
+    pending_video_ids = iter(video_ids)
+    with ThreadPoolExecutor(
+        max_workers=args.n_downloaders
+    ) as download_executor, get_transcribe_executor(
+        args
+    ) as transcribe_executor, utils.open_completed_manifest(
+        args.transcript_output_dir
+    ) as manifest:
+        # Maps each in-flight future to its stage ("download" or "transcribe") and video id
+        futures = {}
+        # Downloaded videos waiting for a free transcription worker
+        downloaded = collections.deque()
+        download_infos = {}
+
+        def schedule():
+            stages = [stage for stage, _ in futures.values()]
+            # Keep every transcription worker busy with a downloaded video
+            num_transcribing = stages.count("transcribe")
+            while downloaded and num_transcribing < args.n_procs:
+                video_id = downloaded.popleft()
+                future = transcribe_executor.submit(
+                    transcribe_download, args, video_id, download_infos[video_id]
+                )
+                futures[future] = ("transcribe", video_id)
+                num_transcribing += 1
+            # Downloads run ahead of transcription, but only by a bounded number of videos so
+            # audio doesn't pile up on disk faster than it can be transcribed
+            num_downloading = stages.count("download")
+            while num_downloading + len(downloaded) < 2 * args.n_downloaders:
+                video_id = next(pending_video_ids, None)
+                if video_id is None:
+                    break
+                future = download_executor.submit(download, args, downloader, video_id)
+                futures[future] = ("download", video_id)
+                num_downloading += 1
+
+        schedule()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, video_id = futures.pop(future)
+                info = future.result()
+
+                if stage == "download" and info is not None:
+                    download_infos[video_id] = info
+                    downloaded.append(video_id)
+                    continue
+
+                download_info = download_infos.pop(video_id, None)
+                if info is None:
+                    postfix["Errors"] += 1
+                else:
+                    postfix["Videos Processed"] += 1
+                    postfix["Transcribed Size (MB)"] += info["nbytes"] / 1e6
+                    postfix["Downloaded Size (GB)"] += download_info["nbytes"] / 1e9
+                    pbar.update(video_durations[video_id])
+                    manifest.write(f"{video_id}\n")
+
+                pbar.set_postfix(postfix, refresh=False)
+            schedule()
+
+    downloader.close()
 
 
 def main():
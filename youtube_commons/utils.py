@@ -1,45 +1,128 @@
 import hashlib
 import os
+import re
+import tempfile
+import zlib
 
 
-def video_id_to_shard(video_id, num_shards):
-    h = hashlib.sha256(video_id.encode())
-    h_bytes = h.digest()
-    h_int = int.from_bytes(h_bytes, byteorder="big")
-    return h_int % num_shards
+# Name of the file listing one finished video id per line in a transcript output directory
+COMPLETED_MANIFEST = "completed.txt"
+
+
+def video_id_to_shard(video_id, num_shards, legacy=False):
+    if legacy:
+        # SHA-256 assignment used by older versions, kept to reproduce existing shards
+        h_bytes = hashlib.sha256(video_id.encode()).digest()
+        return int.from_bytes(h_bytes, byteorder="big") % num_shards
+    # Sharding only needs a stable, uniform hash; CRC-32 is much cheaper than a cryptographic one
+    return zlib.crc32(video_id.encode()) % num_shards
+
+
+# ISO 8601 durations as returned by the YouTube API, e.g. PT1H2M3S, P1DT2H or P0D. The
+# lookaheads require at least one component overall and at least one after the T.
+_DURATION_RE = re.compile(
+    r"P(?!$)(?:(\d+)W)?(?:(\d+)D)?(?:T(?=\d)(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?"
+)
+
+
+def parse_duration(duration):
+    """
+    Convert an ISO 8601 duration string into a number of seconds.
+    """
+    match = _DURATION_RE.fullmatch(duration or "")
+    if match is None:
+        raise ValueError(f"Unsupported duration {duration!r}")
+    weeks, days, hours, minutes, seconds = match.groups()
+    return (
+        int(weeks or 0) * 604800
+        + int(days or 0) * 86400
+        + int(hours or 0) * 3600
+        + int(minutes or 0) * 60
+        + float(seconds or 0)
+    )
 
 
 def video_id_to_path(root_dir, video_id, extension):
     return os.path.join(root_dir, video_id[:2], f"{video_id}{extension}")
 
 
-def get_existing_video_ids(directory, keep_exts=None, filter_exts=None):
+def iter_existing_video_paths(directory, keep_exts=None, filter_exts=None):
     """
-    Find video ids for existing files of the form `{directory}/{video_id[:2]}/{video_id}.{extension}`
+    Yield `(video_id, path)` for existing files of the form `{directory}/{video_id[:2]}/{video_id}.{extension}`
     where `extension` is in `keep_exts` and not in `filter_exts`.
     Default behavior for `keep_exts` is keep all extensions.
     Default behavior for `filter_exts` is filter out no extensions.
     """
-    existing_video_ids = set()
-
-    # Only keep subdirectories that are two characters long
-    subdirs = [s for s in os.listdir(directory) if len(s) == 2]
-    for subdir in subdirs:
-        # Only keep files whose name prefix matches the subdir name
-        files = [
-            f for f in os.listdir(os.path.join(directory, subdir)) if f[:2] == subdir
-        ]
-        if len(files) == 0:
+    keep_exts = frozenset(keep_exts) if keep_exts is not None else None
+    filter_exts = frozenset(filter_exts) if filter_exts is not None else frozenset()
+    for subdir in os.scandir(directory):
+        # Only keep subdirectories that are two characters long
+        if len(subdir.name) != 2 or not subdir.is_dir():
             continue
-        # Filter out partial downloads with the .part extension
-        video_ids, extensions = list(zip(*[os.path.splitext(f) for f in files]))
-        keep_exts = set(extensions) if keep_exts is None else keep_exts
-        filter_exts = set() if filter_exts is None else filter_exts
-        video_ids = [
-            v
-            for v, e in zip(video_ids, extensions)
-            if e in keep_exts and e not in filter_exts
-        ]
-        existing_video_ids.update(set(video_ids))
-
-    return existing_video_ids
+        for entry in os.scandir(subdir.path):
+            # Only keep files whose name prefix matches the subdir name
+            if entry.name[:2] != subdir.name:
+                continue
+            video_id, extension = os.path.splitext(entry.name)
+            if keep_exts is not None and extension not in keep_exts:
+                continue
+            if extension in filter_exts:
+                continue
+            yield video_id, entry.path
+
+
+def get_existing_video_paths(directory, keep_exts=None, filter_exts=None):
+    """
+    Map video ids to paths for existing files (see `iter_existing_video_paths`).
+    """
+    return dict(iter_existing_video_paths(directory, keep_exts, filter_exts))
+
+
+def get_existing_video_ids(directory, keep_exts=None, filter_exts=None):
+    """
+    Find video ids for existing files (see `iter_existing_video_paths`).
+    """
+    return frozenset(
+        video_id
+        for video_id, _ in iter_existing_video_paths(directory, keep_exts, filter_exts)
+    )
+
+
+def get_completed_video_ids(directory):
+    """
+    Read the ids of videos with finished transcripts in `directory` from its completed manifest.
+    If there is no manifest yet, fall back to scanning for `.txt` files and write one.
+    """
+    manifest_path = os.path.join(directory, COMPLETED_MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return frozenset(line.strip() for line in f if line.strip())
+
+    video_ids = get_existing_video_ids(directory, keep_exts=[".txt"])
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{COMPLETED_MANIFEST}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.writelines(f"{video_id}\n" for video_id in video_ids)
+        # mkstemp creates the file owner-only; give it the permissions the umask allows
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        # Linking fails if the manifest already exists, so a run seeding concurrently can never
+        # replace a manifest that another run has already opened for appending
+        try:
+            os.link(tmp_path, manifest_path)
+        except FileExistsError:
+            pass
+    finally:
+        os.remove(tmp_path)
+    return video_ids
+
+
+def open_completed_manifest(directory):
+    """
+    Open the completed manifest of `directory` for appending. It is line buffered so each
+    id is written out as soon as it is recorded.
+    """
+    # Seed a missing manifest with the existing transcripts so it stays complete
+    get_completed_video_ids(directory)
+    return open(os.path.join(directory, COMPLETED_MANIFEST), "a", buffering=1)
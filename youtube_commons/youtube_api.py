@@ -1,6 +1,8 @@
 from functools import wraps
+from itertools import islice
 from urllib.error import HTTPError
 import logging
+import threading
 
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
@@ -8,65 +10,122 @@ from googleapiclient.errors import HttpError
 
 logger = logging.getLogger(__name__)
 
+# Partial responses: only request the fields that are actually read from each API
+CHANNEL_FIELDS = "items(id,snippet/title,contentDetails/relatedPlaylists/uploads)"
+VIDEO_FIELDS = "items(id,status/license,snippet(title,description,tags,publishedAt),contentDetails/duration)"
+PLAYLIST_ITEM_FIELDS = "items(contentDetails/videoId),nextPageToken"
+
 
 def batched(n):
+    # Wrapped functions must be generators; results are yielded batch by batch as they arrive
     def decorator(func):
         @wraps(func)
-        def wrapper(self, lst, *args, **kwargs):
-            ret = []
-            for i in range(0, len(lst), n):
-                ret.extend(func(self, lst[i : i + n], *args, **kwargs))
-            return ret
+        def wrapper(self, items, *args, **kwargs):
+            # Accepts any iterable, so ids can be streamed in without building a list first
+            it = iter(items)
+            batch = list(islice(it, n))
+            while batch:
+                yield from func(self, batch, *args, **kwargs)
+                batch = list(islice(it, n))
 
         return wrapper
 
     return decorator
 
 
+class NoMoreAPIKeysError(Exception):
+    pass
+
+
+class ExhaustedAPIKeys:
+    """
+    Thread-safe set of API keys that have run out of quota. Callers on different threads share
+    one instance so a dead key is dropped by all of them as soon as any one finds it.
+    """
+
+    def __init__(self):
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    def add(self, api_key):
+        with self._lock:
+            self._keys.add(api_key)
+
+    def __contains__(self, api_key):
+        with self._lock:
+            return api_key in self._keys
+
+
 def cycle_api_keys(func):
     @wraps(func)
     def wrapper(self, *args, **kwargs):
-        while len(self.api_keys) > 0:
+        while True:
+            # Another caller may already have found the current key out of quota
+            if self.api_key in self.exhausted_keys and not self.init_caller():
+                break
             try:
                 return func(self, *args, **kwargs)
             except HttpError as e:
                 if e.status_code == 403:
-                    self.init_caller()
+                    self.exhausted_keys.add(self.api_key)
+                    if not self.init_caller():
+                        break
                     logger.info(
                         f"Cycled API keys. {len(self.api_keys) + 1} keys remaining."
                     )
                 else:
                     raise e
 
-        raise Exception("No more API keys")
+        raise NoMoreAPIKeysError("No more API keys")
 
     return wrapper
 
 
 class YouTubeAPICaller:
-    def __init__(self, api_keys):
+    def __init__(self, api_keys, exhausted_keys=None):
         self.api_keys = api_keys
-        self.init_caller()
+        self.exhausted_keys = (
+            exhausted_keys if exhausted_keys is not None else ExhaustedAPIKeys()
+        )
+        if not self.init_caller():
+            raise NoMoreAPIKeysError("No more API keys")
 
     def init_caller(self):
-        self.caller = build("youtube", "v3", developerKey=self.api_keys.pop())
+        """
+        Switch to the next key not known to be exhausted. Returns False if none are left.
+        """
+        while len(self.api_keys) > 0:
+            api_key = self.api_keys.pop()
+            if api_key not in self.exhausted_keys:
+                self.api_key = api_key
+                self.caller = build("youtube", "v3", developerKey=api_key)
+                return True
+        return False
 
     @cycle_api_keys
     def channels_api_call(self, part, channel_ids):
-        request = self.caller.channels().list(part=part, id=channel_ids)
+        request = self.caller.channels().list(
+            part=part, id=channel_ids, fields=CHANNEL_FIELDS
+        )
         metadata = request.execute()
         return metadata
 
     @cycle_api_keys
     def videos_api_call(self, part, video_ids):
-        request = self.caller.videos().list(part=part, id=video_ids)
+        request = self.caller.videos().list(
+            part=part, id=video_ids, fields=VIDEO_FIELDS
+        )
         metadata = request.execute()
         return metadata
 
     @cycle_api_keys
     def playlist_api_call(self, part, playlist_id, next_page_token):
         request = self.caller.playlistItems().list(
-            part=part, playlistId=playlist_id, maxResults=50, pageToken=next_page_token
+            part=part,
+            playlistId=playlist_id,
+            maxResults=50,
+            pageToken=next_page_token,
+            fields=PLAYLIST_ITEM_FIELDS,
         )
         response = request.execute()
         return response
@@ -76,8 +135,9 @@ class YouTubeAPICaller:
         if len(channel_ids) == 0:
             return
 
-        metadata = self.channels_api_call("snippet", channel_ids)
-        for item in metadata["items"]:
+        # contentDetails carries the uploads playlist and costs no extra quota
+        metadata = self.channels_api_call("snippet,contentDetails", channel_ids)
+        for item in metadata.get("items", []):
             yield item
 
     @batched(50)
@@ -86,17 +146,29 @@ class YouTubeAPICaller:
             return
 
         metadata = self.videos_api_call("snippet,contentDetails,status", video_ids)
-        for item in metadata["items"]:
+        for item in metadata.get("items", []):
             yield item
 
-    def get_cc_videos_from_channel(self, channel_id, skip_video_ids=set()):
-        channel_metadata = self.channels_api_call("contentDetails", channel_id)
-        if "items" not in channel_metadata:
+    @batched(50)
+    def get_uploads_playlist_ids(self, channel_ids):
+        if len(channel_ids) == 0:
             return
 
-        uploads_playlist_id = channel_metadata["items"][0]["contentDetails"][
-            "relatedPlaylists"
-        ]["uploads"]
+        metadata = self.channels_api_call("contentDetails", channel_ids)
+        for item in metadata.get("items", []):
+            yield item["id"], item["contentDetails"]["relatedPlaylists"]["uploads"]
+
+    def get_cc_videos_from_channel(
+        self, channel_id, skip_video_ids=set(), uploads_playlist_id=None
+    ):
+        if uploads_playlist_id is None:
+            channel_metadata = self.channels_api_call("contentDetails", channel_id)
+            if "items" not in channel_metadata:
+                return
+
+            uploads_playlist_id = channel_metadata["items"][0]["contentDetails"][
+                "relatedPlaylists"
+            ]["uploads"]
         next_page_token = None
         while True:
             try:
@@ -109,7 +181,7 @@ class YouTubeAPICaller:
 
             video_ids = [
                 item["contentDetails"]["videoId"]
-                for item in response["items"]
+                for item in response.get("items", [])
                 if item["contentDetails"]["videoId"] not in skip_video_ids
             ]
             for video_metadata in self.get_video_metadata(video_ids):